@@ -17,6 +17,7 @@ setup(
     maintainer_email='ville.brofeldt@streamroller.io',
     url='https://github.com/tikki-fi/tikki',
     include_package_data=True,
+    python_requires='>=3.7',
     license='MIT',
     entry_points={
         'console_scripts': [
@@ -25,10 +26,13 @@ setup(
     },
     install_requires=[
         'alembic',
+        'cachetools',
         'cryptography',
         'flask',
         'flask-cors',
-        'flask-jwt-simple',
+        'flask-jwt-extended',
+        'numpy',
+        'orjson',
         'pandas',
         'pyjwt',
         'python-dateutil',
@@ -40,7 +44,6 @@ setup(
     classifiers=[
         "Programming Language :: Python",
         "Programming Language :: Python :: 3",
-        'Programming Language :: Python :: 3.6',
         'Programming Language :: Python :: 3.7',
         'Intended Audience :: Developers',
         'License :: OSI Approved :: MIT License',
@@ -1,9 +1,15 @@
 """
 Tests for utils module
 """
+import json
+from decimal import Decimal
 from unittest import TestCase, mock
 from uuid import UUID
 
+import flask
+from werkzeug.test import EnvironBuilder
+from werkzeug.wrappers import Request
+
 from tikki import exceptions, utils
 
 
@@ -42,6 +48,15 @@ class UtilsGetArgsTestCase(TestCase):
         self.assertDictEqual(utils.get_args(self.received,
                                             constant=self.constant), expected)
 
+    def test_get_args_spec(self):
+        expected = {'a': 2, 'c': 2, 'b': 'c'}
+        spec = utils.ArgSpec(required=self.required,
+                             defaultable=self.defaultable,
+                             optional=self.optional,
+                             constant=self.constant)
+        self.assertDictEqual(utils.get_args(self.received, spec=spec), expected)
+        self.assertDictEqual(utils.get_args(self.received, spec=spec), expected)
+
     def test_get_args_all(self):
         expected = {'a': 2, 'c': 2, 'b': 'c'}
         self.assertDictEqual(utils.get_args(self.received,
@@ -51,6 +66,22 @@ class UtilsGetArgsTestCase(TestCase):
                                             constant=self.constant), expected)
 
 
+class UtilsGetArgsLazyDefaultTestCase(TestCase):
+    def test_get_args_lazy_default_missing(self):
+        factory = mock.Mock(return_value=3)
+        defaultable = {'c': utils.LazyDefault(factory, int)}
+        self.assertDictEqual(utils.get_args({'a': 1}, defaultable=defaultable),
+                             {'c': 3})
+        factory.assert_called_once_with()
+
+    def test_get_args_lazy_default_present(self):
+        factory = mock.Mock(return_value=3)
+        defaultable = {'a': utils.LazyDefault(factory, int)}
+        self.assertDictEqual(utils.get_args({'a': 1}, defaultable=defaultable),
+                             {'a': 1})
+        factory.assert_not_called()
+
+
 class UuidTestCase(TestCase):
     def test_generate_uuid_default(self):
         val = utils.generate_uuid()
@@ -81,3 +112,66 @@ class RequestTestCase(TestCase):
         request = self.get_request_mock()
         request.is_json = True
         self.assertIsNone(utils.flask_validate_request_is_json(request))
+
+
+class ResponseTestCase(TestCase):
+    def test_return_success(self):
+        uuid = utils.generate_uuid()
+        response, status = utils.flask_return_success({'id': uuid, 'lat': Decimal('1.5')})
+        self.assertEqual(status, 200)
+        self.assertEqual(response.mimetype, 'application/json')
+        self.assertDictEqual(json.loads(response.get_data()),
+                             {'result': {'id': str(uuid), 'lat': 1.5}})
+
+    def test_return_exception(self):
+        response, status = utils.flask_return_exception('error', 400)
+        self.assertEqual(status, 400)
+        self.assertDictEqual(json.loads(response.get_data()),
+                             {'http_status_code': 400, 'error': 'error'})
+
+    def test_return_conditional(self):
+        request = Request(EnvironBuilder().get_environ())
+        response, status = utils.flask_return_conditional(request, [1], 'no-cache',
+                                                          vary=('Authorization',))
+        self.assertEqual(status, 200)
+        self.assertEqual(response.headers['Cache-Control'], 'no-cache')
+        self.assertIn('Authorization', response.vary)
+        etag, _ = response.get_etag()
+
+        headers = {'If-None-Match': f'"{etag}"'}
+        request = Request(EnvironBuilder(headers=headers).get_environ())
+        response, status = utils.flask_return_conditional(request, [1], 'no-cache',
+                                                          vary=('Authorization',))
+        self.assertEqual(status, 304)
+        self.assertEqual(response.get_data(), b'')
+        self.assertIn('Authorization', response.vary)
+
+        # Proxies may weaken the ETag, which must still match
+        headers = {'If-None-Match': f'W/"{etag}"'}
+        request = Request(EnvironBuilder(headers=headers).get_environ())
+        response, status = utils.flask_return_conditional(request, [1], 'no-cache')
+        self.assertEqual(status, 304)
+
+    def test_stream_success(self):
+        with flask.Flask(__name__).test_request_context():
+            response, status = utils.flask_stream_success(iter([{'a': 1}, 2]))
+            data = response.get_data()
+        self.assertEqual(status, 200)
+        self.assertDictEqual(json.loads(data), {'result': [{'a': 1}, 2]})
+
+    def test_stream_success_close(self):
+        class Results(object):
+            closed = False
+
+            def __iter__(self):
+                return iter(())
+
+            def close(self):
+                self.closed = True
+
+        results = Results()
+        with flask.Flask(__name__).test_request_context():
+            response, _ = utils.flask_stream_success(results)
+            # Closing the response must release the results without iterating them
+            response.close()
+        self.assertTrue(results.closed)
@@ -4,19 +4,26 @@
 This module serves the RESTful interface required by the Tikki application.
 """
 import datetime
+import hashlib
 import logging
-from typing import Any, Dict
+import threading
+import time
+from typing import Any, Dict, List, Optional, Set
+from uuid import UUID
 
-from flask import Flask, jsonify, request
+from cachetools import TTLCache
+from flask import Flask, request
 from flask_cors import CORS
-from flask_jwt_simple import (JWTManager, create_jwt, get_jwt_identity,
-                              jwt_optional, jwt_required)
+from flask_jwt_extended import (JWTManager, create_access_token, get_jwt_identity,
+                                jwt_required)
+from flask_jwt_extended import view_decorators as jwt_view_decorators
+import numpy as np
 import requests
 
 from tikki import utils
 from tikki.db import api as db_api
 from tikki.db import metadata as db_metadata
-from tikki.db.tables import Event, Record, RecordType, User, UserEventLink
+from tikki.db.tables import Event, Record, User, UserEventLink
 from tikki.exceptions import AppException, FlaskRequestException
 from tikki.version import get_version
 
@@ -28,42 +35,115 @@ db_api.init(app)
 jwt = JWTManager(app)
 CORS(app)
 
+# Decoded JWT payloads, keyed by a hash of the raw token so that bearer tokens are
+# never kept in memory. Entries are dropped after 30 seconds or once the token
+# expires, whichever comes first.
+_jwt_cache: TTLCache = TTLCache(maxsize=10000, ttl=30)
+_jwt_cache_lock = threading.Lock()
+_decode_token = jwt_view_decorators.decode_token
+
+
+def _decode_token_cached(encoded_token: str, csrf_value: Optional[str] = None,
+                         allow_expired: bool = False) -> Dict[str, Any]:
+    """
+    Drop-in replacement for flask_jwt_extended's decode_token that skips signature
+    verification for tokens that have been validated recently.
+
+    :param encoded_token: the raw JWT from the Authorization header
+    :param csrf_value: expected CSRF double submit value, if any
+    :param allow_expired: whether expired tokens should be accepted
+    :return: the decoded JWT payload
+    """
+    if csrf_value is not None or allow_expired:
+        return _decode_token(encoded_token, csrf_value, allow_expired)
+
+    key = hashlib.sha256(encoded_token.encode()).hexdigest()[:32]
+    with _jwt_cache_lock:
+        jwt_data = _jwt_cache.get(key)
+    if jwt_data is not None and jwt_data.get('exp', 0) > time.time():
+        return jwt_data
+
+    jwt_data = _decode_token(encoded_token)
+    with _jwt_cache_lock:
+        _jwt_cache[key] = jwt_data
+    return jwt_data
+
+
+jwt_view_decorators.decode_token = _decode_token_cached
+
+# Auth0 user info lookups for opaque tokens. The session keeps the TLS connection to
+# Auth0 open between logins, and successful responses are cached per token so that
+# repeated logins with the same token don't require a round-trip.
+AUTH0_USERINFO_URL = 'https://tikkifi.eu.auth0.com/userinfo'
+_auth0_session = requests.Session()
+_auth0_userinfo_cache: TTLCache = TTLCache(maxsize=1000, ttl=300)
+_auth0_userinfo_cache_lock = threading.Lock()
+
+
+def _get_auth0_userinfo(token: str) -> Dict[str, Any]:
+    """
+    Retrieve the Auth0 user info corresponding to an opaque access token.
+
+    :param token: opaque Auth0 access token
+    :return: the user info returned by Auth0
+    """
+    key = hashlib.sha256(token.encode()).hexdigest()[:32]
+    with _auth0_userinfo_cache_lock:
+        body = _auth0_userinfo_cache.get(key)
+    if body is not None:
+        return body
+
+    response = _auth0_session.get(
+        url=AUTH0_USERINFO_URL,
+        headers={"Authorization": f"Bearer {token}"},
+        timeout=10,
+    )
+    body = response.json()
+    if 'sub' in body:
+        with _auth0_userinfo_cache_lock:
+            _auth0_userinfo_cache[key] = body
+    return body
+
+
+_OBJ_TYPE_BY_PATH = {
+    'user': User,
+    'record': Record,
+    'event': Event,
+    'user-event-link': UserEventLink,
+}
+
+# Matches any of the object endpoints with a single rule
+_OBJ_RULE = '/<any({}):obj>'.format(','.join(f'"{path}"' for path in _OBJ_TYPE_BY_PATH))
+
 
 def get_obj_type(path):
-    if path == '/user':
-        return User
-    elif path == '/record':
-        return Record
-    elif path == '/event':
-        return Event
-    elif path == 'user-event-link':
-        return UserEventLink
+    return _OBJ_TYPE_BY_PATH[path.strip('/')]
+
 
+@jwt.user_identity_loader
+def get_identity_for_access_token(identity):
+    return identity['sub']
 
-@jwt.jwt_data_loader
+
+@jwt.additional_claims_loader
 def add_claims_to_access_token(identity):
     return {
         'exp': identity['exp'],
         'iat': identity['iat'],
         'nbf': identity['iat'],
-        'sub': identity['sub'],
         'rol': identity['rol']
     }
 
 
 @app.route('/login', methods=['POST'])
 def login():
-    app.logger.debug(request)
+    app.logger.debug('%s', request)
     token = utils.get_args(request.json, required={'token': str})['token']
     user_payload: Dict[str, Any] = {}
     try:
         if "." not in token:
             # "new" opaque token
-            response = requests.get(
-                url="https://tikkifi.eu.auth0.com/userinfo",
-                headers={"Authorization": f"Bearer {token}"},
-            )
-            body = response.json()
+            body = _get_auth0_userinfo(token)
             if 'email' in body:
                 user_payload["email"] = body["email"]
             if 'name' in body:
@@ -89,7 +169,7 @@ def login():
         identity = utils.create_jwt_identity(user)
         return utils.flask_return_success(
             {
-                'jwt': create_jwt(identity),
+                'jwt': create_access_token(identity),
                 'user': user_payload if user_payload else user.json_dict
             }
         )
@@ -97,16 +177,13 @@ def login():
         return utils.flask_handle_exception(e)
 
 
-@app.route('/user', methods=['DELETE'], strict_slashes=False)
-@app.route('/record', methods=['DELETE'], strict_slashes=False)
-@app.route('/event', methods=['DELETE'], strict_slashes=False)
-@app.route('/user-event-link', methods=['DELETE'], strict_slashes=False)
-@jwt_required
-def delete_record():
+@app.route(_OBJ_RULE, methods=['DELETE'], strict_slashes=False)
+@jwt_required()
+def delete_record(obj):
     try:
         # Check object type based on endpoint and define filters accordingly.
 
-        obj_type = get_obj_type(request.path)
+        obj_type = get_obj_type(obj)
         required_args = {}
         if obj_type is UserEventLink:
             required_args['event_id'] = str
@@ -131,7 +208,8 @@ def get_uuid():
                               )
         count = args['count']
         if 0 < count <= 1024:
-            return utils.flask_return_success(utils.generate_uuid(count))
+            return utils.flask_return_success(utils.generate_uuid(count),
+                                              cache_control='no-store')
         else:
             return utils.flask_return_exception('The count parameter cannot be below 1 '
                                                 'or greater than 1024.', 400)
@@ -140,96 +218,90 @@ def get_uuid():
 
 
 @app.route('/whoami', methods=['GET'], strict_slashes=False)
-@jwt_optional
+@jwt_required(optional=True)
 def get_whoami():
     try:
 
         user = get_jwt_identity()
         if user is None:
-            return utils.flask_return_success('Nobody')
+            return utils.flask_return_success('Nobody', cache_control='no-store')
         else:
-            return utils.flask_return_success(user)
+            return utils.flask_return_success(user, cache_control='no-store')
     except Exception as e:
         return utils.flask_handle_exception(e)
 
 
 @app.route('/schema', methods=['GET'], strict_slashes=False)
-@jwt_optional
+@jwt_required(optional=True)
 def get_schema():
     log.info('schema')
     try:
         jwt_id = get_jwt_identity()
-        type_dict = dict()
+        recorded_type_ids: Set[Any] = set()
         if jwt_id is not None:
             filters = {'user_id': str(jwt_id)}
-            records = db_api.get_rows(Record, filters)
-
-            # sort records based on user_id and creation date to pick most recent
-            # result per user
-            # TODO: sort in db.get_rows
-
-            records.sort(key=lambda x: (x.type_id, x.created_at), reverse=True)
-            lag_type_id = None
-            for record in records:
-                if lag_type_id != record.type_id:
-                    lag_type_id = record.type_id
-                    type_dict[record.type_id] = record
+            recorded_type_ids = db_api.get_distinct_values(Record, 'type_id', filters)
 
-        rows = db_api.get_rows(RecordType, {})
         result_list = list()
-        for row in rows:
-            result = row.json_dict
-            result['ask'] = 1 if jwt_id is not None and row.category_id == 2 and \
-                row.id not in type_dict else 0
+        for row in db_api.get_record_types():
+            result = dict(row)
+            result['ask'] = 1 if jwt_id is not None and row['category_id'] == 2 and \
+                row['id'] not in recorded_type_ids else 0
             result_list.append(result)
-        return utils.flask_return_success(result_list)
+        # ask flags depend on the bearer token
+        return utils.flask_return_conditional(request, result_list,
+                                              cache_control='private, max-age=30',
+                                              vary=('Authorization',))
     except Exception as ex:
         return utils.flask_handle_exception(ex)
 
 
 @app.route('/user', methods=['GET'], strict_slashes=False)
-@jwt_required
+@jwt_required()
 def get_user():
     filters = utils.get_args(received=request.args,
                              optional={'id': str, 'username': str},
                              )
     try:
-        users = db_api.get_rows(User, filters)
-        return utils.flask_return_success([i.json_dict for i in users])
+        return utils.flask_stream_success(db_api.iter_dicts(User, filters))
     except Exception as e:
         return utils.flask_handle_exception(e)
 
 
+_POST_USER_ARGS = utils.ArgSpec(defaultable={'id': utils.uuid_lazy(),
+                                             'created_at': utils.now_lazy(),
+                                             'updated_at': utils.now_lazy(),
+                                             'payload': utils.LazyDefault(dict, dict)},
+                                constant={'type_id': 1},
+                                )
+
+
 @app.route('/user', methods=['POST'], strict_slashes=False)
 def post_user():
     try:
         utils.flask_validate_request_is_json(request)
         payload = utils.get_auth0_payload(app, request)
-        now = datetime.datetime.now()
-        uuid = str(utils.generate_uuid())
-        in_user = utils.get_args(received=request.json,
-                                 defaultable={'id': uuid, 'created_at': now,
-                                              'updated_at': now, 'payload': {}},
-                                 constant={'type_id': 1},
-                                 )
+        in_user = utils.get_args(received=request.json, spec=_POST_USER_ARGS)
         in_user['username'] = payload['sub']
         user = db_api.add_row(User, in_user)
         identity = utils.create_jwt_identity(user, payload)
-        return utils.flask_return_success({'jwt': create_jwt(identity),
+        return utils.flask_return_success({'jwt': create_access_token(identity),
                                           'user': user.json_dict})
     except Exception as e:
         return utils.flask_handle_exception(e)
 
 
+_PUT_USER_ARGS = utils.ArgSpec(defaultable={'created_at': utils.now_lazy(),
+                                            'updated_at': utils.now_lazy(),
+                                            'payload': utils.LazyDefault(dict, dict)})
+
+
 @app.route('/user', methods=['PUT'], strict_slashes=False)
-@jwt_required
+@jwt_required()
 def put_user():
     try:
         utils.flask_validate_request_is_json(request)
-        now = datetime.datetime.now()
-        in_user = utils.get_args(received=request.json,
-                                 defaultable={'created_at': now, 'updated_at': now,
-                                              'payload': {}})
+        in_user = utils.get_args(received=request.json, spec=_PUT_USER_ARGS)
         filters = {'id': get_jwt_identity()}
         user = db_api.update_row(User, filters, in_user)
         return utils.flask_return_success(user.json_dict)
@@ -237,17 +309,18 @@ def put_user():
         return utils.flask_handle_exception(e)
 
 
+_PATCH_USER_ARGS = utils.ArgSpec(required={'id': str},
+                                 defaultable={'updated_at': utils.now_lazy()},
+                                 optional={'created_at': datetime.datetime,
+                                           'payload': dict})
+
+
 @app.route('/user', methods=['PATCH'], strict_slashes=False)
-@jwt_required
+@jwt_required()
 def patch_user():
     try:
         utils.flask_validate_request_is_json(request)
-        now = datetime.datetime.now()
-        in_user = utils.get_args(received=request.json,
-                                 required={'id': str},
-                                 defaultable={'updated_at': now},
-                                 optional={'created_at': datetime.datetime,
-                                           'payload': dict})
+        in_user = utils.get_args(received=request.json, spec=_PATCH_USER_ARGS)
         filters = {'id': in_user.pop('id', None)}
         user = db_api.update_row(User, filters, in_user)
         return utils.flask_return_success(user.json_dict)
@@ -255,39 +328,48 @@ def patch_user():
         return utils.flask_handle_exception(e)
 
 
+_COOPERS_TEST_TYPE_ID = int(db_metadata.RecordTypeEnum.COOPERS_TEST)
+_PUSH_UP_60_TEST_TYPE_ID = int(db_metadata.RecordTypeEnum.PUSH_UP_60_TEST)
+
+
+def _get_quantile(records: List[Record], user_record: Optional[Record], key: str,
+                  dtype: Any) -> float:
+    """
+    Calculate the quantile of a user's result among the results of all users.
+
+    :param records: the most recent record of each user
+    :param user_record: the most recent record of the user, if any
+    :param key: the payload key containing the result
+    :param dtype: numpy dtype of the result
+    :return: the quantile of the user's result, or 0 if the user has no result
+    """
+    if user_record is None or len(records) == 0:
+        return 0
+    values = np.fromiter((record.payload[key] for record in records), dtype=dtype,
+                         count=len(records))
+    values.sort()
+    index = np.searchsorted(values, user_record.payload[key])
+    return float((index + 1) / values.size)
+
+
 @app.route('/test/cooperstest/compstat', methods=['GET'], strict_slashes=False)
-@jwt_required
+@jwt_required()
 def get_cooperstest_compstat():
     try:
         user_id = get_jwt_identity()
-        filters = {'type_id': int(db_metadata.RecordTypeEnum.COOPERS_TEST)}
-        records = db_api.get_rows(Record, filters)
-
-        # sort records based on user_id and creation date to pick most recent
-        # result per user
-        # TODO: do sorting in db.get_rows
-        records.sort(key=lambda x: (x.user_id, x.created_at), reverse=True)
-        filtered_records = list()
-        lag_user_id = None
+        filters = {'type_id': _COOPERS_TEST_TYPE_ID}
+
+        # pick most recent result per user
+        filtered_records = db_api.get_latest_rows(Record, filters, 'user_id',
+                                                  'created_at')
+        user_uuid = UUID(user_id)
         user_record = None
-        for record in records:
-            if lag_user_id != record.user_id:
-                lag_user_id = record.user_id
-                filtered_records.append(record)
-                if user_id == str(record.user_id):
-                    user_record = record
-
-        # sort filtered records and get index for quantile calculation
-        try:
-            index = sorted(filtered_records,
-                           key=lambda x: x.payload['distance']).index(user_record)
-        except ValueError:
-            index = None
-
-        if index is None or len(filtered_records) == 0:
-            quantile = 0
-        else:
-            quantile = (index + 1) / len(filtered_records)
+        for record in filtered_records:
+            if record.user_id == user_uuid:
+                user_record = record
+                break
+
+        quantile = _get_quantile(filtered_records, user_record, 'distance', np.float64)
         return utils.flask_return_success({'quantile': quantile})
 
     except Exception as e:
@@ -295,49 +377,33 @@ def get_cooperstest_compstat():
 
 
 @app.route('/test/pushup60test/compstat', methods=['GET'], strict_slashes=False)
-@jwt_required
+@jwt_required()
 def get_pushup60test_compstat():
     try:
         user_id = get_jwt_identity()
         if user_id is None:
-            return jsonify({'message': 'Undefined user id.'}), 400
-        filters = {'type_id': int(db_metadata.RecordTypeEnum.PUSH_UP_60_TEST)}
-        records = db_api.get_rows(Record, filters)
-
-        # sort records based on user_id and creation date to pick most recent
-        # result per user
-        # TODO: sort in db.get_rows
+            return utils.flask_return_exception('Undefined user id.', 400)
+        filters = {'type_id': _PUSH_UP_60_TEST_TYPE_ID}
 
-        records.sort(key=lambda x: (x.user_id, x.created_at), reverse=True)
-        filtered_records = list()
-        lag_user_id = None
+        # pick most recent result per user
+        filtered_records = db_api.get_latest_rows(Record, filters, 'user_id',
+                                                  'created_at')
+        user_uuid = UUID(user_id)
         user_record = None
-        for record in records:
-            if lag_user_id != record.user_id:
-                lag_user_id = record.user_id
-                filtered_records.append(record)
-                if user_id == str(record.user_id):
-                    user_record = record
-
-        # sort filtered records and get index for quantile calculation
-        filtered_records.sort(key=lambda x: x.payload['pushups'])
-        try:
-            index = filtered_records.index(user_record)
-        except ValueError:
-            index = None
-
-        if index is None or len(filtered_records) == 0:
-            quantile = 0
-        else:
-            quantile = (index + 1) / len(filtered_records)
-        return jsonify({'result': {'quantile': quantile}}), 200
+        for record in filtered_records:
+            if record.user_id == user_uuid:
+                user_record = record
+                break
+
+        quantile = _get_quantile(filtered_records, user_record, 'pushups', np.int64)
+        return utils.flask_return_success({'quantile': quantile})
 
     except Exception as e:
         return utils.flask_return_exception(e, 500)
 
 
 @app.route('/record', methods=['GET'], strict_slashes=False)
-@jwt_required
+@jwt_required()
 def get_record():
     filters = utils.get_args(
         received=request.args,
@@ -345,84 +411,110 @@ def get_record():
         optional={'id': str, 'event_id': str, 'type_id': int},
     )
     try:
-        rows = db_api.get_rows(Record, filters)
-        return utils.flask_return_success([row.json_dict for row in rows])
+        rows = db_api.iter_dicts(Record, filters, transform=Record.strip_unset)
+        return utils.flask_stream_success(rows)
     except Exception as e:
         return utils.flask_handle_exception(e)
 
 
+_NEW_RECORD_ARGS = utils.ArgSpec(
+    optional={'event_id': str},
+    defaultable={
+        'id': utils.uuid_lazy(),
+        'created_at': utils.now_lazy(),
+        'updated_at': utils.now_lazy(),
+        'payload': utils.LazyDefault(dict, dict),
+        'type_id': 0,
+        'created_user_id': utils.jwt_identity_lazy(),
+    }
+)
+_RECORD_CREATED_USER_ARGS = utils.ArgSpec(
+    defaultable={'created_user': utils.jwt_identity_lazy()})
+_RECORD_VALIDATED_ARGS = utils.ArgSpec(defaultable={'validated_at': utils.now_lazy()},
+                                       optional={'validated_user_id': str},
+                                       )
+
+
+def _get_new_record_row(received: Dict[str, Any], user_id: str) -> Dict[str, Any]:
+    """
+    Build the row for a new record from the received json object.
+
+    :param received: json object describing the record
+    :param user_id: id of the user creating the record
+    :return: a dict that can be passed to db_api.add_row
+    """
+    # created_user_id defaults to the JWT identity, i.e. the user_id
+    row = utils.get_args(received=received, spec=_NEW_RECORD_ARGS)
+    row['user_id'] = user_id
+
+    # And finally add details of who validated the record and when if provided.
+    validated = utils.get_args(received=received, spec=_RECORD_VALIDATED_ARGS)
+    if 'validated_user_id' in validated:
+        row.update(validated)
+    return row
+
+
 @app.route('/record', methods=['POST'], strict_slashes=False)
-@jwt_required
+@jwt_required()
 def post_record():
     try:
         utils.flask_validate_request_is_json(request)
-        now = datetime.datetime.now()
-        uuid = str(utils.generate_uuid())
-        row = utils.get_args(
-            received=request.json,
-            optional={'event_id': str},
-            constant={
-                'user_id': get_jwt_identity(),
-            },
-            defaultable={
-                'id': uuid,
-                'created_at': now,
-                'updated_at': now,
-                'payload': {},
-                'type_id': 0,
-            }
-        )
+        row = _get_new_record_row(request.json, get_jwt_identity())
+        record = db_api.add_row(Record, row)
+        return utils.flask_return_success(record.json_dict)
+    except Exception as e:
+        return utils.flask_handle_exception(e)
 
-        # Add created_user which defaults to the user_id, merging it with the
-        # main row object.
-        user_id = row['user_id']
-        created_user = utils.get_args(received=request.json,
-                                      defaultable={'created_user_id': user_id},
-                                      )
-        row.update(created_user)
 
-        # And finally add details of who validated the record and when if provided.
-        validated = utils.get_args(received=request.json,
-                                   defaultable={'validated_at': now},
-                                   optional={'validated_user_id': str},
-                                   )
-        if 'validated_user_id' in validated:
-            row.update(validated)
+_POST_RECORDS_ARGS = utils.ArgSpec(required={'records': list})
+_MAX_POST_RECORDS = 1024
 
-        record = db_api.add_row(Record, row)
-        return utils.flask_return_success(record.json_dict)
+
+@app.route('/records', methods=['POST'], strict_slashes=False)
+@jwt_required()
+def post_records():
+    try:
+        utils.flask_validate_request_is_json(request)
+        user_id = get_jwt_identity()
+        received = utils.get_args(received=request.json,
+                                  spec=_POST_RECORDS_ARGS)['records']
+        if not 0 < len(received) <= _MAX_POST_RECORDS:
+            return utils.flask_return_exception('The number of records cannot be below 1 '
+                                                f'or greater than {_MAX_POST_RECORDS}.',
+                                                400)
+        if not all(isinstance(i, dict) for i in received):
+            return utils.flask_return_exception('Each record must be a JSON object.',
+                                                400)
+        rows = [_get_new_record_row(i, user_id) for i in received]
+        records = db_api.add_rows(Record, rows)
+        return utils.flask_return_success([i.json_dict for i in records])
     except Exception as e:
         return utils.flask_handle_exception(e)
 
 
+_PATCH_RECORD_ARGS = utils.ArgSpec(required={'id': str},
+                                   defaultable={'updated_at': utils.now_lazy()},
+                                   optional={'created_at': datetime.datetime,
+                                             'payload': dict, 'type_id': int,
+                                             'event_id': str},
+                                   )
+
+
 @app.route('/record', methods=['PATCH'], strict_slashes=False)
-@jwt_required
+@jwt_required()
 def patch_record():
     try:
         utils.flask_validate_request_is_json(request)
-        now = datetime.datetime.now()
-        row = utils.get_args(received=request.json,
-                             required={'id': str},
-                             defaultable={'updated_at': now},
-                             optional={'created_at': datetime.datetime,
-                                       'payload': dict, 'type_id': int,
-                                       'event_id': str},
-                             )
+        row = utils.get_args(received=request.json, spec=_PATCH_RECORD_ARGS)
 
         # Add created_user which defaults to the user_id, merging it with the
         # main row object.
-        user = get_jwt_identity()
-
         created_user = utils.get_args(received=request.json,
-                                      defaultable={'created_user': user},
-                                      )
+                                      spec=_RECORD_CREATED_USER_ARGS)
         row.update(created_user)
 
         # And finally add details of who validated the record and when if provided.
-        validated = utils.get_args(received=request.json,
-                                   defaultable={'validated_at': now},
-                                   optional={'validated_user_id': str},
-                                   )
+        validated = utils.get_args(received=request.json, spec=_RECORD_VALIDATED_ARGS)
         if validated.get('validated_user_id') is not None:
             row.update(validated)
 
@@ -433,35 +525,32 @@ def patch_record():
         return utils.flask_handle_exception(e)
 
 
+_PUT_RECORD_ARGS = utils.ArgSpec(defaultable={'id': utils.uuid_lazy(),
+                                              'created_at': utils.now_lazy(),
+                                              'updated_at': utils.now_lazy(),
+                                              'payload': utils.LazyDefault(dict, dict),
+                                              'type_id': 0,
+                                              'user_id': utils.jwt_identity_lazy()},
+                                 optional={'event_id': str},
+                                 )
+
+
 @app.route('/record', methods=['PUT'], strict_slashes=False)
-@jwt_required
+@jwt_required()
 def put_record():
     try:
         utils.flask_validate_request_is_json(request)
-        now = datetime.datetime.now()
-        uuid = str(utils.generate_uuid())
-        user = get_jwt_identity()
-        row = utils.get_args(received=request.json,
-                             defaultable={'id': uuid, 'created_at': now,
-                                          'updated_at': now, 'payload': {},
-                                          'type_id': 0,
-                                          'user_id': user},
-                             optional={'event_id': str},
-                             )
+        row = utils.get_args(received=request.json, spec=_PUT_RECORD_ARGS)
         filters = {'id': row.pop('id', None)}
 
         # Add created_user which defaults to the user_id, merging it with the
         # main row object.
         created_user = utils.get_args(received=request.json,
-                                      defaultable={'created_user': user},
-                                      )
+                                      spec=_RECORD_CREATED_USER_ARGS)
         row.update(created_user)
 
         # And finally add details of who validated the record and when if provided.
-        validated = utils.get_args(received=request.json,
-                                   defaultable={'validated_at': now},
-                                   optional={'validated_user_id': str},
-                                   )
+        validated = utils.get_args(received=request.json, spec=_RECORD_VALIDATED_ARGS)
         if validated.get('validated_user_id') is not None:
             row.update(validated)
 
@@ -472,7 +561,7 @@ def put_record():
 
 
 @app.route('/event', methods=['GET'], strict_slashes=False)
-@jwt_required
+@jwt_required()
 def get_event():
     filters = utils.get_args(received=request.args,
                              optional={'id': str, 'user_id': str, 'type_id': int},
@@ -484,22 +573,24 @@ def get_event():
         return utils.flask_handle_exception(e)
 
 
+_EVENT_ARGS = utils.ArgSpec(required={'name': str, 'description': str,
+                                      'address': str, 'postal_code': str,
+                                      'event_at': datetime.datetime},
+                            defaultable={'id': utils.uuid_lazy(),
+                                         'created_at': utils.now_lazy(),
+                                         'updated_at': utils.now_lazy(),
+                                         'payload': utils.LazyDefault(dict, dict),
+                                         'organization_id': 0,
+                                         'user_id': utils.jwt_identity_lazy()},
+                            )
+
+
 @app.route('/event', methods=['POST'], strict_slashes=False)
-@jwt_required
+@jwt_required()
 def post_event():
     try:
         utils.flask_validate_request_is_json(request)
-        now = datetime.datetime.now()
-        uuid = str(utils.generate_uuid())
-        user = get_jwt_identity()
-        row = utils.get_args(received=request.json,
-                             required={'name': str, 'description': str,
-                                       'address': str, 'postal_code': str,
-                                       'event_at': datetime.datetime},
-                             defaultable={'id': uuid, 'created_at': now,
-                                          'updated_at': now, 'payload': {},
-                                          'organization_id': 0, 'user_id': user},
-                             )
+        row = utils.get_args(received=request.json, spec=_EVENT_ARGS)
         event = db_api.add_row(Event, row)
         return utils.flask_return_success(event.json_dict)
     except Exception as e:
@@ -507,21 +598,11 @@ def post_event():
 
 
 @app.route('/event', methods=['PUT'], strict_slashes=False)
-@jwt_required
+@jwt_required()
 def put_event():
     try:
         utils.flask_validate_request_is_json(request)
-        now = datetime.datetime.now()
-        uuid = str(utils.generate_uuid())
-        user = get_jwt_identity()
-        row = utils.get_args(received=request.json,
-                             required={'name': str, 'description': str,
-                                       'address': str, 'postal_code': str,
-                                       'event_at': datetime.datetime},
-                             defaultable={'id': uuid, 'created_at': now,
-                                          'updated_at': now, 'payload': {},
-                                          'organization_id': 0, 'user_id': user},
-                             )
+        row = utils.get_args(received=request.json, spec=_EVENT_ARGS)
 
         filters = {'id': row.pop('id', None)}
         event = db_api.update_row(Event, filters, row)
@@ -531,30 +612,32 @@ def put_event():
 
 
 @app.route('/user-event-link', methods=['GET'], strict_slashes=False)
-@jwt_required
+@jwt_required()
 def get_user_event_link():
     filters = utils.get_args(received=request.args,
                              optional={'user_id': str, 'event_id': str},
                              )
     try:
-        rows = db_api.get_rows(UserEventLink, filters)
-        return utils.flask_return_success([row.json_dict for row in rows])
+        return utils.flask_stream_success(db_api.iter_dicts(UserEventLink, filters))
     except Exception as e:
         return utils.flask_handle_exception(e)
 
 
+_POST_USER_EVENT_LINK_ARGS = utils.ArgSpec(
+    required={'event_id': str},
+    defaultable={'created_at': utils.now_lazy(),
+                 'updated_at': utils.now_lazy(),
+                 'user_id': utils.jwt_identity_lazy(),
+                 'payload': utils.LazyDefault(dict, dict)},
+)
+
+
 @app.route('/user-event-link', methods=['POST'], strict_slashes=False)
-@jwt_required
+@jwt_required()
 def post_user_event_link():
     try:
         utils.flask_validate_request_is_json(request)
-        now = datetime.datetime.now()
-        user = get_jwt_identity()
-        row = utils.get_args(received=request.json,
-                             required={'event_id': str},
-                             defaultable={'created_at': now, 'updated_at': now,
-                                          'user_id': user, 'payload': {}},
-                             )
+        row = utils.get_args(received=request.json, spec=_POST_USER_EVENT_LINK_ARGS)
 
         obj = db_api.add_row(UserEventLink, row)
         return utils.flask_return_success(obj.json_dict)
@@ -568,21 +651,21 @@ def hello():
 
 
 @app.route("/test", methods=['GET'])
-@jwt_optional
+@jwt_required(optional=True)
 def test():
     try:
         args = utils.get_args(received=request.args, required={'type': str})
         if args['type'] == 'error':
-            log.error(f'!! {request}')
+            log.error('!! %s', request)
         elif args['type'] == 'warning':
-            log.warning(request)
+            log.warning('%s', request)
         elif args['type'] == 'info':
-            log.info(request)
+            log.info('%s', request)
         elif args['type'] == 'debug':
-            log.debug(request)
+            log.debug('%s', request)
         return utils.flask_return_success(args)
     except (AppException, FlaskRequestException) as e:
-        log.error(request)
+        log.error('%s', request)
         return utils.flask_handle_exception(e)
 
 
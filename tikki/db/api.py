@@ -1,7 +1,10 @@
 """ Module for handling database interactions """
 import logging
-from typing import Any, Dict, List, Type, TypeVar
+import threading
+from typing import (Any, Callable, Dict, Iterator, List, Optional, Set, Tuple, Type,
+                    TypeVar)
 
+from cachetools import TTLCache, cached
 import sqlalchemy as sa
 import sqlalchemy.orm as sao
 
@@ -11,8 +14,12 @@ from tikki.db.tables import Base, RecordType, TestLimit
 from tikki.exceptions import NoRecordsException, TooManyRecordsException
 
 # Initialisation
+ENGINE = None  # type: Any
 SESSION = None  # type: Any
 
+# Record types change only when dimensions are regenerated
+_record_type_cache: TTLCache = TTLCache(maxsize=1, ttl=60)
+
 T = TypeVar('T')
 
 
@@ -22,12 +29,39 @@ def init(app):
     Requires that the Flask app config has been initialized with the following variables:
      - SQLA_DB_URI
 
+    Sessions are scoped to the current thread. Changes made during a request are
+    flushed by the functions in this module and committed once after the request if
+    the response was successful, otherwise they are rolled back. The session is
+    removed when the app context is torn down, returning the connection to the pool.
+
+    Pooled connections must not be shared between processes. If the app is loaded
+    before forking worker processes, e.g. with gunicorn's preload_app, call
+    ENGINE.dispose() in each worker after forking, e.g. from gunicorn's post_fork hook.
+
     :param app: Flask app object.
     """
-    global SESSION
-
-    engine = sa.create_engine(app.config['SQLALCHEMY_DATABASE_URI'])
-    SESSION = sao.sessionmaker(bind=engine)
+    global ENGINE, SESSION
+
+    ENGINE = sa.create_engine(app.config['SQLALCHEMY_DATABASE_URI'],
+                              poolclass=sa.pool.QueuePool,
+                              pool_size=10,
+                              max_overflow=20,
+                              pool_recycle=3600,
+                              pool_pre_ping=True,
+                              )
+    SESSION = sao.scoped_session(sao.sessionmaker(bind=ENGINE))
+
+    @app.after_request
+    def commit_session(response):
+        if response.status_code < 400:
+            SESSION.commit()
+        else:
+            SESSION.rollback()
+        return response
+
+    @app.teardown_appcontext
+    def remove_session(exception=None):
+        SESSION.remove()
 
 
 def get_rows(base_class: Type[Base], filter_by: Dict[str, Any]) -> List[Base]:
@@ -40,10 +74,134 @@ def get_rows(base_class: Type[Base], filter_by: Dict[str, Any]) -> List[Base]:
     global SESSION
     session = SESSION()
     rows = session.query(base_class).filter_by(**filter_by).all()
-    session.close()
     return rows
 
 
+def _select_table(base_class: Type[Base], filter_by: Dict[str, Any]) -> Any:
+    table = base_class.__table__
+    query = sa.select([table])
+    for key, value in filter_by.items():
+        query = query.where(table.c[key] == value)
+    return query
+
+
+class _DictStream(object):
+    """
+    Iterator over a streamed query result that fetches rows in chunks and releases its
+    connection once it is exhausted or closed, even if iteration never started.
+    """
+    def __init__(self, connection: Any, result: Any, chunk_size: int,
+                 transform: Optional[Callable[[Dict[str, Any]], Dict[str, Any]]]):
+        self._connection = connection
+        self._result = result
+        self._chunk_size = chunk_size
+        self._transform = transform
+        self._rows: Iterator[Any] = iter(())
+
+    def __iter__(self) -> '_DictStream':
+        return self
+
+    def __next__(self) -> Dict[str, Any]:
+        row = next(self._rows, None)
+        if row is None:
+            if self._result is None:
+                raise StopIteration
+            rows = self._result.fetchmany(self._chunk_size)
+            if not rows:
+                self.close()
+                raise StopIteration
+            self._rows = iter(rows)
+            row = next(self._rows)
+        val = dict(row)
+        return val if self._transform is None else self._transform(val)
+
+    def close(self) -> None:
+        if self._result is not None:
+            self._result.close()
+            self._connection.close()
+            self._result = self._connection = None
+
+
+def iter_dicts(base_class: Type[Base], filter_by: Dict[str, Any],
+               chunk_size: int = 500,
+               transform: Optional[Callable[[Dict[str, Any]], Dict[str, Any]]] = None) \
+        -> _DictStream:
+    """Function for streaming rows from the database as dicts. The rows are read
+    directly from the table without constructing SQL Alchemy objects, so relationships
+    are not loaded. The query is executed immediately, but rows are only fetched from
+    the database in chunks as the returned iterator is consumed.
+
+    The iterator holds a dedicated database connection, which is released when the
+    iterator is exhausted or its close method is called.
+
+    :param base_class: SQL Alchemy object type to be retrieved.
+    :param filter_by: Filters specifying which rows should be retrieved.
+    :param chunk_size: Number of rows to fetch from the database at a time.
+    :param transform: Function applied to each dict before it is returned.
+    :return: closable iterator of dicts mapping column names to values
+    """
+    global ENGINE
+    # Use a dedicated connection, as the session is committed before the response
+    # has been streamed.
+    connection = ENGINE.connect()
+    try:
+        query = _select_table(base_class, filter_by)
+        result = connection.execution_options(stream_results=True).execute(query)
+    except Exception:
+        connection.close()
+        raise
+    return _DictStream(connection, result, chunk_size, transform)
+
+
+def get_latest_rows(base_class: Type[Base], filter_by: Dict[str, Any],
+                    partition_by: str, order_by: str) -> List[Base]:
+    """Function for retrieving the most recent row per group from the database.
+
+    Uses DISTINCT ON, which is specific to PostgreSQL.
+
+    :param base_class: SQL Alchemy object type to be retrieved.
+    :param filter_by: Filters specifying which rows should be retrieved.
+    :param partition_by: Name of the column by which rows are grouped.
+    :param order_by: Name of the column that determines the most recent row per group.
+    :return: list of SQL Alchemy objects, one per distinct value of partition_by
+    """
+    global SESSION
+    session = SESSION()
+    partition_column = getattr(base_class, partition_by)
+    order_column = getattr(base_class, order_by)
+    rows = session.query(base_class).filter_by(**filter_by) \
+        .distinct(partition_column) \
+        .order_by(partition_column, order_column.desc()).all()
+    return rows
+
+
+def get_distinct_values(base_class: Type[Base], column: str,
+                        filter_by: Dict[str, Any]) -> Set[Any]:
+    """Function for retrieving the distinct values of a single column from the database.
+
+    :param base_class: SQL Alchemy object type to be queried.
+    :param column: Name of the column whose values should be retrieved.
+    :param filter_by: Filters specifying which rows should be considered.
+    :return: set of distinct values
+    """
+    global SESSION
+    session = SESSION()
+    rows = session.query(getattr(base_class, column)).filter_by(**filter_by) \
+        .distinct().all()
+    return {row[0] for row in rows}
+
+
+@cached(cache=_record_type_cache, lock=threading.Lock())
+def get_record_types() -> Tuple[Dict[str, Any], ...]:
+    """Function for retrieving all record types from the database. The result is
+    cached for 60 seconds.
+
+    :return: tuple of json dicts of the record types. These are shared between
+    calls and must not be modified.
+    """
+    return tuple(row.json_dict for row in get_rows(RecordType, {}))
+
+
 def get_row(base_class: Type[Base], filter_by: Dict[str, Any]) -> Base:
     """Function for retrieving a row from the database.
 
@@ -54,7 +212,6 @@ def get_row(base_class: Type[Base], filter_by: Dict[str, Any]) -> Base:
     global SESSION
     session = SESSION()
     row = session.query(base_class).filter_by(**filter_by).first()
-    session.close()
     return row
 
 
@@ -69,10 +226,28 @@ def add_row(base_class: Type[Base], params: Dict[str, Any]) -> Base:
     session = SESSION()
     row = base_class(**params)
     session.add(row)
-    session.commit()
+    session.flush()
     return row
 
 
+def add_rows(base_class: Type[Base], params_list: List[Dict[str, Any]]) -> List[Base]:
+    """Function for adding multiple rows into the database.
+
+    The rows are inserted in bulk, bypassing the session's unit of work, so the
+    returned objects are not attached to a session.
+
+    :param base_class: SQL Alchemy object type to be created.
+    :param params_list: List of parameters of the objects to be created.
+    :return: list of SQL Alchemy objects
+    """
+    global SESSION
+    session = SESSION()
+    rows = [base_class(**params) for params in params_list]
+    session.bulk_save_objects(rows)
+    session.flush()
+    return rows
+
+
 def delete_row(base_class: Type[Base], filter_by: Dict[str, Any]) -> None:
     """Function for deleting a single row in the database.
 
@@ -90,7 +265,7 @@ def delete_row(base_class: Type[Base], filter_by: Dict[str, Any]) -> None:
     elif rows_affected > 1:
         session.rollback()
         raise TooManyRecordsException
-    session.commit()
+    session.flush()
 
 
 def delete_rows(base_class: Type[Base], filter_by: Dict[str, Any]):
@@ -105,7 +280,7 @@ def delete_rows(base_class: Type[Base], filter_by: Dict[str, Any]):
     rows_affected = session.query(base_class).filter_by(**filter_by).delete()
     if rows_affected == 0:
         raise NoRecordsException
-    session.commit()
+    session.flush()
 
 
 def update_row(base_class: Type[Base], filter_by: Dict[str, Any],
@@ -137,7 +312,7 @@ def update_row(base_class: Type[Base], filter_by: Dict[str, Any],
     row = rows[0]
     for key, value in params.items():
         setattr(row, key, value)
-    session.commit()
+    session.flush()
     return row
 
 
@@ -165,7 +340,7 @@ def update_rows(base_class: Type[Base], filter_by: Dict[str, Any],
     for row in rows:
         for key, value in params.items():
             setattr(row, key, value)
-        session.commit()
+    session.flush()
     return rows
 
 
@@ -189,6 +364,7 @@ def regenerate_dimensions():
             session.add(record_type)
 
         session.commit()
+        _record_type_cache.clear()
     except Exception as ex:
         print(ex)
         logger.exception(ex)
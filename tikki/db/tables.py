@@ -125,6 +125,26 @@ class Record(Base):
     validated_user_id = sa.Column(UUIDType, nullable=True)
     validated_at = sa.Column(sa.DateTime, nullable=True)
     payload = sa.Column(JSONType, nullable=False)
+    __table_args__ = (
+        sa.Index('ix_record_type_user_created', type_id, user_id, created_at.desc()),
+        sa.Index('ix_record_user_id', user_id),
+    )
+
+    # Columns that are left out of the json representation when they are not set
+    _optional_json_keys = ('event_id', 'validated_at', 'validated_user_id',
+                           'parent_record_id')
+
+    @classmethod
+    def strip_unset(cls, val: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Remove optional columns that are not set from a dict representation of a
+        record, e.g. a row read directly from the table.
+
+        :param val: dict mapping column names to values
+        :return: the dict without unset optional columns
+        """
+        return {key: value for key, value in val.items()
+                if value is not None or key not in cls._optional_json_keys}
 
     @property
     def json_dict(self):
@@ -135,16 +155,13 @@ class Record(Base):
                'created_user_id': str(self.created_user_id),
                'type_id': self.type_id,
                'payload': self.payload,
+               'event_id': self.event_id,
+               'validated_at': self.validated_at.isoformat() if self.validated_at
+               else None,
+               'validated_user_id': self.validated_user_id,
+               'parent_record_id': self.parent_record_id,
                }
-        if self.event_id is not None:
-            val['event_id'] = self.event_id
-        if self.validated_at:
-            val['validated_at'] = self.validated_at.isoformat()
-        if self.validated_user_id:
-            val['validated_user_id'] = self.validated_user_id
-        if self.parent_record_id:
-            val['parent_record_id'] = self.parent_record_id
-        return val
+        return self.strip_unset(val)
 
 
 class Event(Base):
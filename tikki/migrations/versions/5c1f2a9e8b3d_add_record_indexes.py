@@ -0,0 +1,26 @@
+"""add record indexes
+
+Revision ID: 5c1f2a9e8b3d
+Revises: ea592060b0b5
+Create Date: 2026-10-15 12:04:51.318210
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = '5c1f2a9e8b3d'
+down_revision = 'ea592060b0b5'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_record_type_user_created', 'fact_record',
+                    ['type_id', 'user_id', sa.text('created_at DESC')])
+    op.create_index('ix_record_user_id', 'fact_record', ['user_id'])
+
+
+def downgrade():
+    op.drop_index('ix_record_user_id', table_name='fact_record')
+    op.drop_index('ix_record_type_user_created', table_name='fact_record')
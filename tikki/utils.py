@@ -4,19 +4,23 @@ more than once that isn't specific to any certain functionality here.
 """
 
 import datetime
+import decimal
+import hashlib
 import json
 import logging
 import os
 import traceback
 import urllib.request
-from typing import Any, Dict, List, Optional, Tuple, Type, Union
+from typing import (Any, Callable, Dict, Iterable, List, Optional, Tuple, Type,
+                    Union)
 from uuid import UUID, uuid4
 
 import dateutil.parser
 import flask
 import jwt
+import orjson
 from flask import has_request_context, request
-from flask_jwt_simple import get_jwt_identity
+from flask_jwt_extended import get_jwt_identity
 from jwt.algorithms import RSAAlgorithm  # type: ignore
 from werkzeug.datastructures import MultiDict
 
@@ -85,7 +89,11 @@ def init_app(app: Any):
             if has_request_context():
                 record.url = request.url
                 record.remote_addr = request.remote_addr
-                jwt_identity = get_jwt_identity()
+                try:
+                    jwt_identity = get_jwt_identity()
+                except RuntimeError:
+                    # JWT has not been verified for this request
+                    jwt_identity = None
                 record.jwt_identity = '' if jwt_identity is None else jwt_identity
             else:
                 record.url, record.remote_addr, record.jwt_identity = '', '', ''
@@ -104,6 +112,7 @@ def init_app(app: Any):
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
     missing_vars: List[str] = []
     _add_config_from_env(app, 'JWT_SECRET_KEY', 'TIKKI_JWT_SECRET', missing_vars)
+    app.config['JWT_ALGORITHM'] = 'HS256'
     _add_config_from_env(app, 'SQLALCHEMY_DATABASE_URI', 'TIKKI_SQLA_DB_URI', missing_vars)  # noqa
     _add_config_from_env(app, 'AUTH0_AUDIENCE', 'TIKKI_AUTH0_AUDIENCE', missing_vars)
 
@@ -127,6 +136,53 @@ def create_jwt_identity(user: tables.Base) -> Dict[str, Any]:
     return identity
 
 
+class LazyDefault(object):
+    """
+    Default value for get_args that is only evaluated if the key is missing from
+    the received dict.
+    """
+    def __init__(self, factory: Callable[[], Any], default_type: Type[Any]):
+        """
+        :param factory: function returning the default value
+        :param default_type: the type of the value if present in the received dict
+        """
+        self.factory = factory
+        self.default_type = default_type
+
+
+def get_request_time() -> datetime.datetime:
+    """
+    Retrieve the time at which the current request was first asked for its time.
+    Repeated calls within the same request return the same value.
+
+    :return: timestamp of the current request
+    """
+    if 'now' not in flask.g:
+        flask.g.now = datetime.datetime.now()
+    return flask.g.now
+
+
+def now_lazy() -> LazyDefault:
+    """
+    :return: a lazy default evaluating to the timestamp of the current request
+    """
+    return LazyDefault(get_request_time, datetime.datetime)
+
+
+def uuid_lazy() -> LazyDefault:
+    """
+    :return: a lazy default evaluating to a new UUID in string format
+    """
+    return LazyDefault(lambda: str(uuid4()), str)
+
+
+def jwt_identity_lazy() -> LazyDefault:
+    """
+    :return: a lazy default evaluating to the JWT identity of the current request
+    """
+    return LazyDefault(get_jwt_identity, str)
+
+
 def parse_value(value: Any, default_type: Type[Any]) -> Any:
     # datetimes will be sent in string format, therefore need
     # to be parsed first
@@ -147,39 +203,61 @@ def get_anydict_value(source_dict: Dict[str, Any], key: str, default_value: Any,
     raise AppException('Unsupported source_dict type: ' + type(source_dict).__name__)
 
 
+class ArgSpec(object):
+    """
+    Specification of the arguments retrieved by get_args. Specs that don't change
+    between requests should be created once at import time and passed to get_args
+    as spec. See get_args for a description of the parameters.
+    """
+    def __init__(self, required: Optional[Dict[str, Type[Any]]] = None,
+                 defaultable: Optional[Dict[str, Any]] = None,
+                 optional: Optional[Dict[str, Type[Any]]] = None,
+                 constant: Optional[Dict[str, Any]] = None):
+        if required is None and defaultable is None and optional is None \
+                and constant is None:
+            raise AppException('One of the following is required: '
+                               'required, defaultable, optional or constant.')
+
+        self.required = tuple(required.items()) if required else ()
+        self.defaultable = tuple(
+            (key, value, value.default_type if isinstance(value, LazyDefault)
+             else type(value))
+            for key, value in (defaultable.items() if defaultable else ()))
+        self.optional = tuple(optional.items()) if optional else ()
+        self.constant = constant if constant else {}
+
+
 def get_args(received: Dict[str, Any], required: Optional[Dict[str, Type[Any]]] = None,
              defaultable: Optional[Dict[str, Any]] = None,
              optional: Optional[Dict[str, Type[Any]]] = None,
-             constant: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+             constant: Optional[Dict[str, Any]] = None,
+             spec: Optional[ArgSpec] = None) -> Dict[str, Any]:
     """
     Retrieve parameters from a dict or MultiDict
 
     :param received: The dict or MultiDict that contains the source data
     :param required: The name and type of required key/value
     :param defaultable: The name and value of keys that will default to value if missing
-    from received
+    from received. Values of type LazyDefault are only evaluated if the key is missing
     :param optional: The name and type of values that will be extracted from received
     if present
     :param constant: The name and value that will added to return dict. If key is present
     in received, the value will be overwritten by the value in constant
+    :param spec: A prebuilt ArgSpec to use instead of required, defaultable, optional
+    and constant
     :return:
     """
     # Initialize local variables
 
-    if required is None and defaultable is None and optional is None and constant is None:
-        raise AppException('One of the following is required: '
-                           'required, defaultable, optional or constant.')
+    if spec is None:
+        spec = ArgSpec(required, defaultable, optional, constant)
 
-    required = required if required else {}
-    defaultable = defaultable if defaultable else {}
-    optional = optional if optional else {}
-    constant = constant if constant else {}
     missing: List[str] = []
     ret_dict: Dict[str, Any] = {}
 
     # First loop through required args and add missing keys to error list
 
-    for key, default_type in required.items():
+    for key, default_type in spec.required:
         val = get_anydict_value(received, key, None, default_type)
         if val is None:
             missing.append(key)
@@ -187,21 +265,26 @@ def get_args(received: Dict[str, Any], required: Optional[Dict[str, Type[Any]]]
 
     # Next loop through defaultable args, falling back to default values
 
-    for key, default_value in defaultable.items():
-        default_type = type(default_value)
-        val = get_anydict_value(received, key, default_value, default_type)
+    for key, default_value, default_type in spec.defaultable:
+        if isinstance(default_value, LazyDefault):
+            if key in received:
+                val = get_anydict_value(received, key, None, default_type)
+            else:
+                val = default_value.factory()
+        else:
+            val = get_anydict_value(received, key, default_value, default_type)
         ret_dict[key] = val
 
     # Next loop through optional args, omitting them if missing
 
-    for key, default_type in optional.items():
+    for key, default_type in spec.optional:
         val = get_anydict_value(received, key, None, default_type)
         if val is not None:
             ret_dict[key] = val
 
     # Finally copy constants
 
-    ret_dict.update(constant)
+    ret_dict.update(spec.constant)
 
     # Raise error if
 
@@ -224,16 +307,103 @@ def flask_validate_request_is_json(req) -> None:
         raise Flask400Exception('Request body is not JSON.')
 
 
-def flask_return_exception(e, return_type: int = 500) -> Tuple[Dict[str, Any], int]:
-    return flask.jsonify({'http_status_code': return_type, 'error': str(e)}), return_type
+def _json_default(obj: Any) -> Any:
+    """
+    Serialize types not natively supported by orjson.
+    """
+    if isinstance(obj, decimal.Decimal):
+        return float(obj)
+    raise TypeError
+
+
+def _json_dumps(obj: Any) -> bytes:
+    return orjson.dumps(obj, default=_json_default, option=orjson.OPT_SERIALIZE_NUMPY)
+
+
+def flask_json_response(obj: Any, return_type: int = 200,
+                        cache_control: Optional[str] = None) \
+        -> Tuple[flask.Response, int]:
+    """
+    Serialize an object into a json response using orjson.
+
+    :param obj: the object to serialize
+    :param return_type: http status code of the response
+    :param cache_control: value of the Cache-Control header, omitted if None
+    :return: A tuple with the json response and the http status code
+    """
+    response = flask.Response(_json_dumps(obj), mimetype='application/json')
+    if cache_control is not None:
+        response.headers['Cache-Control'] = cache_control
+    return response, return_type
 
 
-def flask_return_success(result, return_type: int = 200):
-    return flask.jsonify({'result': result}), return_type
+def flask_return_exception(e, return_type: int = 500) -> Tuple[flask.Response, int]:
+    return flask_json_response({'http_status_code': return_type, 'error': str(e)},
+                               return_type)
+
+
+def flask_return_success(result, return_type: int = 200,
+                         cache_control: Optional[str] = None) \
+        -> Tuple[flask.Response, int]:
+    return flask_json_response({'result': result}, return_type, cache_control)
+
+
+def flask_stream_success(results: Iterable[Any], return_type: int = 200) \
+        -> Tuple[flask.Response, int]:
+    """
+    Return a successful response whose result is a list, serializing and sending the
+    items one at a time as they are produced.
+
+    :param results: the items of the result list. If it has a close method, it is
+    called when the response is closed.
+    :param return_type: http status code of the response
+    :return: A tuple with the streamed json response and the http status code
+    """
+    def generate():
+        separator = b''
+        yield b'{"result":['
+        for result in results:
+            yield separator + _json_dumps(result)
+            separator = b','
+        yield b']}'
+
+    response = flask.Response(flask.stream_with_context(generate()),
+                              mimetype='application/json')
+    # Release resources held by results even if the body is never iterated, e.g.
+    # for HEAD requests or when the client disconnects before the first chunk.
+    close = getattr(results, 'close', None)
+    if close is not None:
+        response.call_on_close(close)
+    return response, return_type
+
+
+def flask_return_conditional(req, result, cache_control: str,
+                             vary: Iterable[str] = ()) -> Tuple[flask.Response, int]:
+    """
+    Return a successful response tagged with an ETag computed from its body. If the
+    request already has a matching ETag in If-None-Match, an empty 304 Not Modified
+    response is returned instead.
+
+    :param req: Flask http request
+    :param result: the result to return
+    :param cache_control: value of the Cache-Control header
+    :param vary: request headers the result depends on, added to the Vary header
+    :return: A tuple with the response and the http status code
+    """
+    body = _json_dumps({'result': result})
+    etag = hashlib.blake2b(body, digest_size=8).hexdigest()
+    if req.if_none_match.contains_weak(etag):
+        response = flask.Response(status=304)
+    else:
+        response = flask.Response(body, mimetype='application/json')
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = cache_control
+    response.vary.update(vary)
+    return response, response.status_code
 
 
 def flask_handle_exception(exception: Union[FlaskRequestException, DbApiException]) \
-        -> Tuple[Dict[str, Any], int]:
+        -> Tuple[flask.Response, int]:
     """
     Convert exception into tuple that can be returned to the user by Flask
 